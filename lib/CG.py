@@ -1,20 +1,33 @@
+import os
 import re
+import mmap
 import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 
+# matches both misfit (fm) and penalty (fp) norms so the log is only scanned once. It is a bytes
+# pattern so it can run directly over a memory-mapped file without decoding
+_NORM_RE = re.compile(rb"\|\|f(?P<kind>[mp])\(x\)\|\|\^2 = (?P<val>[\d.eE+\-]+)")
+
 def get_fm_fp(file):
 
-    misfit_pattern = r"\|\|fm\(x\)\|\|\^2 = ([\d.e+-]+)"
-    penalty_pattern = r"\|\|fp\(x\)\|\|\^2 = ([\d.e+-]+)"
-    
-    with open(file, "r") as f:
-        data = f.read()
-    fm = re.findall(misfit_pattern, data)
-    fp = re.findall(penalty_pattern, data)
-    fm = list(map(float, fm))
-    fp = list(map(float, fp))
+    fm = []
+    fp = []
+    fm_append = fm.append
+    fp_append = fp.append
+    with open(file, "rb") as f:
+        # mmap can't map an empty file
+        if os.fstat(f.fileno()).st_size > 0:
+            # pages are faulted in as the regex scans them rather than copying the whole log
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for match in _NORM_RE.finditer(mm):
+                    if match.group('kind') == b'm':
+                        fm_append(float(match.group('val')))
+                    else:
+                        fp_append(float(match.group('val')))
     
-    return fm, fp
+    # numpy arrays plot faster than lists of python floats for long CG runs
+    return np.asarray(fm, dtype=np.float64), np.asarray(fp, dtype=np.float64)
 
 def plot_CG(filepath):
     
@@ -1,3 +1,5 @@
+import h5py
+import numpy as np
 from pathlib import Path
 from typing import Union
 from xarray import Dataset, DataArray
@@ -28,10 +30,28 @@ class BisiclesFile:
         file: Path to the BISICLES HDF5 file to read
     """
 
+    # default units and long names of BISICLES outputs
+    _ATTRS = {
+        "thickness"     : {"units": "m",           "long_name": "Ice thickness"},
+        "dThickness/dt" : {"units": "m·yr⁻¹",      "long_name": "Thickness rate of change"},
+        "xVel"          : {"units": "m·yr⁻¹",      "long_name": "X-velocity"},
+        "yVel"          : {"units": "m·yr⁻¹",      "long_name": "Y-velocity"},
+        "Z_base"        : {"units": "m",           "long_name": "Bed elevation"},
+        "Z_surface"     : {"units": "m",           "long_name": "Surface elevation"},
+        "Cwshelf"       : {"units": "Pa·s·m⁻¹",    "long_name": "Basal friction coefficient"},
+        "muCoef"        : {"units": "unitless",    "long_name": "Viscosity coefficient"},
+        "divuh"         : {"units": "kg·m⁻³·s⁻¹",  "long_name": "Flux divergence"},
+        "xVels"         : {"units": "m·yr⁻¹",      "long_name": "Surface X-velocity"},
+        "yVels"         : {"units": "m·yr⁻¹",      "long_name": "Surface Y-velocity"},
+        "xVelb"         : {"units": "m·yr⁻¹",      "long_name": "Basal X-velocity"},
+        "yVelb"         : {"units": "m·yr⁻¹",      "long_name": "Basal Y-velocity"},
+    }
+
     def __init__(self, file: Union[Path, str]):
         self.file = Path(file)
         self._amrID = None
         self._domain_corners = {}  # Cache domain corners by level
+        self._time = None          # read from the HDF5 attrs when available (see _h5_time)
 
         if not self.file.exists():
             raise FileNotFoundError(f"BISICLES file not found: {self.file}")
@@ -51,22 +71,7 @@ class BisiclesFile:
 
     @property
     def attrs(self):
-        # default units and long names of BISICLES outputs
-        return {
-            "thickness"     : {"units": "m",           "long_name": "Ice thickness"},
-            "dThickness/dt" : {"units": "m·yr⁻¹",      "long_name": "Thickness rate of change"},
-            "xVel"          : {"units": "m·yr⁻¹",      "long_name": "X-velocity"},
-            "yVel"          : {"units": "m·yr⁻¹",      "long_name": "Y-velocity"},
-            "Z_base"        : {"units": "m",           "long_name": "Bed elevation"},
-            "Z_surface"     : {"units": "m",           "long_name": "Surface elevation"},
-            "Cwshelf"       : {"units": "Pa·s·m⁻¹",    "long_name": "Basal friction coefficient"},
-            "muCoef"        : {"units": "unitless",    "long_name": "Viscosity coefficient"},
-            "divuh"         : {"units": "kg·m⁻³·s⁻¹",  "long_name": "Flux divergence"},
-            "xVels"         : {"units": "m·yr⁻¹",      "long_name": "Surface X-velocity"},
-            "yVels"         : {"units": "m·yr⁻¹",      "long_name": "Surface Y-velocity"},
-            "xVelb"         : {"units": "m·yr⁻¹",      "long_name": "Basal X-velocity"},
-            "yVelb"         : {"units": "m·yr⁻¹",      "long_name": "Basal Y-velocity"},
-            }
+        return self._ATTRS
 
     def __enter__(self):
         """Context manager entry"""
@@ -86,8 +91,15 @@ class BisiclesFile:
             self._amrID = None
 
     def query_time(self) -> float:
-        """Query the time from the AMR file"""
-        time = amrio.queryTime(self.amrID)
+        """
+        Query the time from the AMR file. Read from the HDF5 attributes (already done if a level 0
+        read has opened the file), only falling back to amrio, which loads the whole AMR
+        hierarchy, if they don't hold the time
+        """
+        if self._time is None:
+            with h5py.File(self.file, 'r') as f:
+                self._time = _h5_time(f)
+        time = self._time if self._time is not None else amrio.queryTime(self.amrID)
         return round(time, 1)
 
     def domain_corners(self, level: int) -> tuple:
@@ -106,23 +118,110 @@ class BisiclesFile:
             data = field,
             dims = ['y', 'x'],
             coords = {'x': x0, 'y': y0},
-            attrs = self.attrs.get(variable, {})
+            attrs = self._ATTRS.get(variable, {})
         )
         return data_array
 
-    def read_dataset(self, variables: list, lev: int=0, order: int=0) -> Dataset:
-        """Extract multiple variables from AMR file and return as xarray Dataset"""
+    def read_dataset(self, variables: list, lev: int=0, order: int=0, dtype=None) -> Dataset:
+        """
+        Extract multiple variables from AMR file and return as xarray Dataset. If dtype is given
+        (e.g. np.float32), fields are cast on read, which halves memory for large lev>0 grids.
+        Level 0 is read directly with h5py (see _read_lev0_h5), falling back to amrio if the file
+        layout isn't recognised
+        """
         
+        # Collect (dims, field, attrs) tuples and build the Dataset once with shared coords,
+        # rather than constructing a DataArray with its own coords for every variable
         flat_data = {}
-        for var in variables:
+        coords = {}
+        fields = None
+        if lev == 0:
+            try:
+                x0, y0, fields = self._read_lev0_h5(variables)
+                coords = {'x': x0, 'y': y0}
+            except (KeyError, ValueError) as e:
+                print(f"Falling back to amrio for {self.file}: {e}")
+        if fields is None:
+            fields = self._read_amrio(variables, lev, order, coords)
+
+        for var, field in fields.items():
             variable_name = var.replace("/", "")  # can't have / in netcdf variable names
+            if dtype is not None:
+                field = field.astype(dtype, copy=False)
+            flat_data[variable_name] = (('y', 'x'), field, self._ATTRS.get(var, {}))
+        ds = Dataset(flat_data, coords=coords)
+        return ds
+
+    def _read_amrio(self, variables: list, lev: int, order: int, coords: dict) -> dict:
+        """Read variables with amrio.readBox2D, filling coords with the x and y cell centres"""
+
+        lo, hi = self.domain_corners(lev)
+        fields = {}
+        for var in variables:
             try:
-                flat_data[variable_name] = self.read_dataarray(var, lev=lev, order=order)
+                x0, y0, field = amrio.readBox2D(self.amrID, lev, lo, hi, var, order)
             except Exception as e:
                 print(f"File {self.file} does not contain variable '{var}'")
                 continue
-        ds = Dataset(flat_data)
-        return ds
+            fields[var] = field
+            coords.update(x=x0, y=y0)
+        return fields
+
+    def _read_lev0_h5(self, variables: list) -> tuple:
+        """
+        Read variables on level 0 straight from the Chombo HDF5 layout with h5py. Level 0 always
+        covers the whole domain, so its boxes can be pasted into one array without amrio having to
+        load the full AMR hierarchy. Each box is stored in level_0/data:datatype=0 as (component,
+        y, x) including ghost cells, starting at level_0/data:offsets=0[box].
+
+        Raises KeyError or ValueError if the file doesn't have the expected layout, so callers can
+        fall back to amrio
+        """
+
+        with h5py.File(self.file, 'r') as f:
+            self._time = _h5_time(f) # saves query_time reopening the file
+            ncomp = int(f.attrs['num_components'])
+            names = []
+            for c in range(ncomp):
+                name = f.attrs[f'component_{c}']
+                names.append(name.decode() if isinstance(name, bytes) else str(name))
+            level = f['level_0']
+            dx = float(level.attrs['dx'])
+            domain = level.attrs['prob_domain']
+            ilo, jlo, ihi, jhi = (int(domain[key]) for key in ('lo_i', 'lo_j', 'hi_i', 'hi_j'))
+            ghost = level['data_attributes'].attrs.get('outputGhost')
+            gi, gj = (0, 0) if ghost is None else (int(ghost['intvecti']), int(ghost['intvectj']))
+            boxes = level['boxes'][:]
+            offsets = level['data:offsets=0'][:]
+            raw = level['data:datatype=0'][:]   # one contiguous read of every box
+
+        comps = {}
+        for var in variables:
+            if var not in names:
+                print(f"File {self.file} does not contain variable '{var}'")
+                continue
+            comps[var] = names.index(var)
+
+        fields = {var: np.full((jhi - jlo + 1, ihi - ilo + 1), np.nan) for var in comps}
+        for box, start, end in zip(boxes, offsets[:-1], offsets[1:]):
+            i0, j0, i1, j1 = (int(box[key]) for key in ('lo_i', 'lo_j', 'hi_i', 'hi_j'))
+            nx = i1 - i0 + 1 + 2 * gi
+            ny = j1 - j0 + 1 + 2 * gj
+            block = raw[start:end].reshape(ncomp, ny, nx)   # ValueError if the layout differs
+            for var, c in comps.items():
+                fields[var][j0 - jlo:j1 - jlo + 1, i0 - ilo:i1 - ilo + 1] = block[c, gj:ny - gj, gi:nx - gi]
+
+        # cell centres, matching the coords amrio.readBox2D returns
+        x0 = (np.arange(ilo, ihi + 1) + 0.5) * dx
+        y0 = (np.arange(jlo, jhi + 1) + 0.5) * dx
+        return x0, y0, fields
+
+def _h5_time(f: h5py.File) -> Union[float, None]:
+    """Time attribute of an open Chombo HDF5 file, stored on the root group or level_0, if present"""
+    for group in (f, f.get('level_0')):
+        if group is not None and 'time' in group.attrs:
+            return float(group.attrs['time'])
+    return None
 
 def _system(cmd):
     import os
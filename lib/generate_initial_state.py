@@ -49,24 +49,38 @@ def convert_C(C: DataArray, xVel: DataArray, yVel: DataArray, m: float=1.0, uf:
     C_f = C_m * [|u|/uf + 1]^m
     """
 
-    print(f'    Converting C into equivalent field for m={m}...')
-    u = np.hypot(xVel, yVel)
-    u = u.where(u>1, 1) # avoid C_m -> 0 when u -> 0
+    if m == 1.0 and uf is None:
+        return C # nothing to convert
 
-    C_m = C * u **(1.0-m)
+    print(f'    Converting C into equivalent field for m={m}...')
+    # work on the underlying numpy arrays, reusing one buffer to avoid temporaries
+    u = np.hypot(xVel.values, yVel.values)
+    np.fmax(u, 1.0, out=u) # avoid C_m -> 0 when u -> 0 (fmax also maps NaN speeds to 1)
+
+    if uf is not None:
+        # Coulomb factor needs the clamped speed, so compute it before u is overwritten
+        factor = np.divide(u, uf)
+        factor += 1.0
+        np.power(factor, m, out=factor)
+
+    C_m = u
+    np.power(u, 1.0-m, out=C_m)
+    np.multiply(C.values, C_m, out=C_m)
     
     if uf is None:
-        return C_m
+        return DataArray(C_m, coords=C.coords, dims=C.dims)
     else:
         print(f'    Applying additional factor for fast sliding speed uf={uf} ma-1...')
-        C_f = C_m * (u/uf + 1)**m
-        return C_f
+        C_f = C_m
+        C_f *= factor
+        return DataArray(C_f, coords=C.coords, dims=C.dims)
 
 def generate_initial_state(infile: str, m: float=1.0, uf: float=None) -> Dataset:
 
     required_vars = ['thickness', 'Z_base', 'Cwshelf', 'muCoef', 'xVelb', 'yVelb']
     with BisiclesFile(infile) as bfile:
-        ds = bfile.read_dataset(required_vars, lev=3)
+        # output is written as float32, so read as float32 to halve memory on the lev=3 grid
+        ds = bfile.read_dataset(required_vars, lev=3, dtype=np.float32)
     
     if m!=1.0 or uf is not None:
         ds['C_m'] = convert_C(ds.Cwshelf, ds.xVelb, ds.yVelb, m=m, uf=uf)
@@ -105,6 +119,7 @@ def main() -> None:
         var: {
             'zlib': True,          # enables compression
             'complevel': 4,        # compression level (1–9)
+            'shuffle': True,       # byte-shuffle before compressing for a better ratio
             'dtype': 'float32',    # reduce file size if precision allows
             '_FillValue': None     # avoids auto-inserting NaNs as fill values
         }
@@ -1,12 +1,18 @@
+import os
+import re
 import numpy as np
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import xarray as xr
 from xarray.coders import CFDatetimeCoder
+from scipy.ndimage import map_coordinates
 
 def separate_levels(ds: xr.Dataset) -> xr.Dataset:
-    data = {}
-    for i, z in enumerate(ds.z):
-        data[f'thermal_forcing_00{i:02d}'] = ds.sel(z=z).thermal_forcing.drop_vars(['z', 'time'])
+    # slice the underlying (numpy or dask) array along z rather than doing a label lookup per level
+    tf = ds.thermal_forcing.transpose('z', 'y', 'x').data
+    attrs = ds.thermal_forcing.attrs # keep units/long_name on every level
+    data = {f'thermal_forcing_00{i:02d}': (('y', 'x'), tf[i], attrs) for i in range(tf.shape[0])}
     return xr.Dataset(data, coords={'x': ds.x, 'y': ds.y})
 
 def regrid_to_bisicles(ds: xr.Dataset) -> xr.Dataset:
@@ -14,42 +20,46 @@ def regrid_to_bisicles(ds: xr.Dataset) -> xr.Dataset:
     bisicles_8km_x = np.arange(4.000e+3, 6.148e+06, 8.000e+3)
     bisicles_centered = bisicles_8km_x - bisicles_8km_x.mean()
 
-    # pad until dataset exceeds the extent of bisicles
-    N = 10 # any big enough number will do
-    padded = ds.pad(x=(N, N), y=(N, N))
-
-    x = ds.x
-    dx = x[1] - x[0]
-    padded_axis_vals = np.arange(x.min() - N*dx, x.max()+N*dx+1, dx)
-    padded['x'] = padded_axis_vals
-    padded['y'] = padded_axis_vals
-
-    # interpolate onto centered bisicles grid
-    ds_bisicles = ds.interp(x=bisicles_centered, y=bisicles_centered)
+    # the ISMIP6 grid is regular, so the centered bisicles grid can be expressed directly as
+    # fractional indices into the source array
+    x = ds.x.values
+    y = ds.y.values
+    ix = (bisicles_centered - x[0]) / (x[1] - x[0])
+    iy = (bisicles_centered - y[0]) / (y[1] - y[0])
+    iy_grid, ix_grid = np.meshgrid(iy, ix, indexing='ij')
+
+    # bilinear interpolation of each level in one C-level pass. Points beyond the source grid
+    # are NaN, as with xarray's interp, and are later filled with zeros
+    thermal_forcing = ds.thermal_forcing.transpose('z', 'y', 'x')
+    regridded = np.stack([
+        map_coordinates(level, [iy_grid, ix_grid], order=1, mode='constant', cval=np.nan)
+        for level in thermal_forcing.values
+    ])
 
     # revert to un-centered grid
-    ds_bisicles['x'] = bisicles_8km_x
-    ds_bisicles['y'] = bisicles_8km_x
+    ds_bisicles = xr.Dataset(
+        {'thermal_forcing': (('z', 'y', 'x'), regridded, thermal_forcing.attrs)},
+        coords={'z': ds.z.values, 'x': bisicles_8km_x, 'y': bisicles_8km_x}
+    )
 
     return ds_bisicles
 
-def ismip_to_bisicles(filepath: Path) -> None:
-
-    info = filepath.name.split('_')
-    model = info[0]
-    scenario = info[1]
+def _outfile(model: str, scenario: str, year: int) -> Path:
+    return Path('bisicles_compatible') / f'thermal_forcing_{model}_{scenario}_8km_{year}.nc'
 
-    coder = CFDatetimeCoder(use_cftime=True)
-    ds = xr.open_dataset(filepath, decode_times=coder)
+def _process_year(filepath: Path, cfyear, model: str, scenario: str) -> None:
 
-    for cfyear in ds.time.values:
-        year = cfyear.year
-        outfile = Path('bisicles_compatible') / f'thermal_forcing_{model}_{scenario}_8km_{year}.nc'
+    year = cfyear.year
+    outfile = _outfile(model, scenario, year)
 
-        if outfile.exists():
-            continue
+    if outfile.exists():
+        return
 
-        print(year)
+    print(year)
+    # each worker opens its own handle – netcdf/hdf5 handles can't be shared across processes.
+    # Chunking by time keeps the arrays lazy so only this year is read when the file is written
+    coder = CFDatetimeCoder(use_cftime=True)
+    with xr.open_dataset(filepath, decode_times=coder, chunks={'time': 1}) as ds:
         timeslice = ds.sel(time=cfyear)
         timeslice = regrid_to_bisicles(timeslice)
         timeslice = separate_levels(timeslice)
@@ -64,6 +74,30 @@ def ismip_to_bisicles(filepath: Path) -> None:
             print(f'Encountered an error whilst writing file: {e}')
             outfile.unlink(missing_ok=True)
 
+def ismip_to_bisicles(filepath: Path) -> None:
+
+    info = filepath.name.split('_')
+    model = info[0]
+    scenario = info[1]
+
+    # if the filename gives the year span (e.g. ..._1995-2300.nc) and every year has already been
+    # written, skip opening the file altogether
+    span = re.search(r'(\d{4})\d{0,2}-(\d{4})\d{0,2}$', filepath.stem)
+    if span:
+        first, last = map(int, span.groups())
+        if all(_outfile(model, scenario, year).exists() for year in range(first, last+1)):
+            print('All years already processed')
+            return
+
+    coder = CFDatetimeCoder(use_cftime=True)
+    with xr.open_dataset(filepath, decode_times=coder) as ds:
+        years = [cfyear for cfyear in ds.time.values if not _outfile(model, scenario, cfyear.year).exists()]
+
+    # years are independent, so regrid and write them in parallel
+    process_year = partial(_process_year, filepath, model=model, scenario=scenario)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(process_year, years))
+
 def main():
     
     outdir = Path('bisicles_compatible')
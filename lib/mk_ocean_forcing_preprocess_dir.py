@@ -1,6 +1,10 @@
+import re
 import argparse
 from pathlib import Path       
 
+# all placeholders are substituted in one scan of each template
+_PLACEHOLDER_RE = re.compile('@(MODEL|model|SCENARIO|REALISATION)')
+
 def main(args) -> None:
     
     MODEL = args.model
@@ -13,12 +17,14 @@ def main(args) -> None:
         utilpath = directory / util
         utilpath.mkdir(parents=True, exist_ok=True)
 
+    values = {
+        'MODEL': MODEL,
+        'model': model,
+        'SCENARIO': args.scenario,
+        'REALISATION': args.realisation,
+    }
     for template in templates.iterdir():
-        content = template.read_text()
-        content = content.replace('@MODEL', MODEL)
-        content = content.replace('@model', model)
-        content = content.replace('@SCENARIO', args.scenario)
-        content = content.replace('@REALISATION', args.realisation)
+        content = _PLACEHOLDER_RE.sub(lambda match: values[match.group(1)], template.read_text())
 
         outfile_name = template.name.replace('template', model)
         outfile = directory / outfile_name
@@ -1,18 +1,15 @@
+import re
 import pandas as pd
 import numpy as np
 import argparse
 from pathlib import Path
 
-def format_value(value) -> str:
+def get_formatter(dtype):
 
-	if type(value) == float:
-		return format(value, 'e')
-	elif type(value) == int:
-		return str(value)
-	elif type(value) == str:
-		return value
-	else:
-		raise ValueError('Value is not int, string or float.')
+    # floats are written in scientific notation, everything else as-is
+    if pd.api.types.is_float_dtype(dtype):
+        return '{:e}'.format
+    return str
         
 
 def main(args) -> None:
@@ -29,13 +26,25 @@ def main(args) -> None:
 
     if 'name' not in columns:
         raise KeyError("PPE requires a 'name' column in order to make directories")
+
+    # read each template once and substitute every placeholder in a single pass. Longest names
+    # are tried first so that e.g. @model is not partially matched by a column called m
+    template_texts = {template: template.read_text() for template in templates.iterdir()}
+    placeholders = [*columns, 'SCENARIO']
+    if 'model' in columns:
+        placeholders.append('lowermodel')
+    placeholders.sort(key=len, reverse=True)
+    placeholder_re = re.compile('@(' + '|'.join(map(re.escape, placeholders)) + ')')
+    formatters = {col: get_formatter(df[col].dtype) for col in columns}
     
-    for i, row in df.iterrows():
+    # itertuples avoids building a Series per row and keeps each column's native type
+    for i, *vals in df.itertuples(index=True, name=None):
         if i+1 < imin:
             continue
         if i+1 > imax:
             break
 
+        row = dict(zip(columns, vals))
         name = row['name']
         run_dir = ensemble_path / name
 
@@ -43,18 +52,13 @@ def main(args) -> None:
             dirpath = run_dir / util
             dirpath.mkdir(parents=True, exist_ok=True)
 
-        for template in templates.iterdir():
-            template_content = template.read_text()
+        values = {col: formatters[col](row[col]) for col in columns}
+        values.setdefault('SCENARIO', scenario)
+        if 'model' in columns:
+            values.setdefault('lowermodel', row['model'].lower())
 
-            script = template_content
-            for col in columns:
-                placeholder = f'@{col}'
-                value = row[col]
-                script = script.replace(placeholder, format_value(value))
-            script = script.replace("@SCENARIO", scenario)
-            
-            if 'model' in columns:
-                script = script.replace("@lowermodel", row['model'].lower())
+        for template, template_content in template_texts.items():
+            script = placeholder_re.sub(lambda match: values[match.group(1)], template_content)
 
             outfile_name = template.name.replace('template', name)
             outfile_name = outfile_name.replace('scenario', scenario)
@@ -3,25 +3,46 @@ import os
 import sys
 import glob
 
-def check_hdf5_files(directory):
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+def has_hdf5_signature(fname):
+
+    '''
+    Reads only the 8-byte HDF5 signature at the start of the file, which
+    is much cheaper than opening it with h5py on a networked filesystem.
+    '''
+
+    with open(fname, 'rb') as f:
+        return f.read(8) == HDF5_SIGNATURE
+
+def check_hdf5_files(directory, quick=False):
 
     '''
     Simply checks if all hdf5 files in a directory can be opened. 
     Useful for instances where BISICLES has been cut off whilst 
     writing to plot or checkpoint files, resulting in corrupted 
     files.
+
+    With quick=True, only the HDF5 signature is checked. This is
+    much faster for large directories but will not catch files
+    that were truncated part way through writing.
     '''
 
     h5_files = glob.glob(os.path.join(directory, '*.hdf5'))
     for fname in h5_files:
         try:
-            with h5py.File(fname, 'r'):
-                pass
+            if quick:
+                if not has_hdf5_signature(fname):
+                    raise OSError('missing HDF5 signature')
+            else:
+                with h5py.File(fname, 'r'):
+                    pass
         except Exception as e:
             print(f"Corrupted or unreadable file: {fname} — {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python check_hdf5.py /path/to/h5/files")
+    args = [arg for arg in sys.argv[1:] if arg != '--quick']
+    if len(args) != 1:
+        print("Usage: python check_hdf5.py /path/to/h5/files [--quick]")
         sys.exit(1)
-    check_hdf5_files(sys.argv[1])
+    check_hdf5_files(args[0], quick='--quick' in sys.argv[1:])
@@ -1,27 +1,40 @@
 #!/bin/env python
 
 """
-Script to extract data from hdf5 ctrl files and save it as a netcdf.
+Script to extract data from hdf5 ctrl files and save it as a netcdf. If the outfile path ends
+in .zarr, the data is instead written to a zarr store compressed with blosc/zstd (requires zarr).
 
 Usage: "python process_ctrl.py <ctrl_directory> <outfile_path> <variable> [<variable>...]
 
 Options:
  --lev      : level of refinement
  --order    : interpolation method (0=piecewise constant, 1=linear)
+ --workers  : number of processes for reading files (default=all cores)
+ --compression : netcdf compression codec, zlib (default) or zstd
+ --separate : write each variable to its own outfile (<outfile stem>_<variable>), processing the
+              variables in parallel
 """
 
-import re
+import os
+import shutil
 import argparse
+import numpy as np
 import xarray as xr
 from pathlib import Path
 from xarray import Dataset
-from collections import defaultdict
+from functools import partial
+from multiprocessing import get_context
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import groupby
+from contextlib import nullcontext
+from operator import itemgetter
 from dask.diagnostics import ProgressBar
 from mpi4py import MPI # needed to run the MPI routines in amrio on archer2
 
 # NB: amrfile and, by extension, BisiclesFile need the BISICLES AMRfile directory added to PYTHONPATH 
 # and the libamrfile directory added to LD_LIBRARY_PATH – see my .bashrc for an example
 from bisiclesfile import BisiclesFile
+from processing import compression_specs, add_processing_args, run_variables
 
 class Processor:
     """
@@ -33,96 +46,162 @@ class Processor:
     :variables: List of variable names to extract, e.g. ['Cwshelf', 'muCoef']
     :lev: Level of refinement to extract (default=0)
     :order: Interpolation order (0=piecewise constant, 1=linear), default=0
+    :workers: Number of processes used to read files in parallel (default=all cores)
+    :compression: netcdf compression codec, 'zlib' (default) or 'zstd'
     """
 
     def __init__(
         self, 
         variables: list, 
         lev: int=0,
-        order: int=0
+        order: int=0,
+        workers: int=None,
+        compression: str='zlib'
     ):
         self.variables = variables
         self.lev = lev
         self.order = order
+        self.workers = workers
+        self.compression = compression
 
-    def encoding_specs(self, variable: str):
-        """Encoding specifications for netcdf storage"""
+    def encoding_specs(self, variable: str, zarr: bool=False):
+        """Encoding specifications for netcdf (default) or zarr storage"""
         dtype = 'int16' if variable == 'muCoef' else 'int32'
         specs = {
-            'zlib': True,
-            'complevel': 3,
             'dtype': dtype,
             'scale_factor': 0.001,   # 3 decimal places precision
             '_FillValue': -9999,
-            'chunksizes': (1, 16, 768, 768)  # (time, iteration, y, x)
         }
+        if zarr:
+            # blosc compresses chunks on multiple threads, unlike netcdf's single-threaded zlib.
+            # Bitshuffle suits the smoothly varying scaled integers well
+            from numcodecs import Blosc # only needed for zarr output
+            specs['compressor'] = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+            specs['chunks'] = (1, 16, 768, 768)  # (time, iteration, y, x)
+        else:
+            specs.update(compression_specs(self.compression, complevel=3))
+            specs['chunksizes'] = (1, 16, 768, 768)  # (time, iteration, y, x)
         return specs
 
-    def batch_iterations(self, iter_file_pairs: list[tuple[int, Path]]) -> Dataset:
+    def batch_iterations(self, iter_file_pairs: list[tuple[int, Path]], executor: Executor=None) -> Dataset:
         """Concatenate all iterations in an inverse problem along the iteration dimension"""
 
-        iter_slices = []
-        for i, file in iter_file_pairs:
+        # files are read concurrently if an executor is given; map keeps them in iteration order
+        read = partial(read_file, variables=self.variables, lev=self.lev, order=self.order)
+        files = [file for _, file in iter_file_pairs]
+        datasets = executor.map(read, files) if executor else map(read, files)
+
+        # Fill one preallocated (iteration, y, x) array per variable rather than concatenating
+        # a Dataset per iteration, so each variable is allocated exactly once
+        n_iters = len(iter_file_pairs)
+        stacks = {}
+        coords = {}
+        for n, ((i, file), ds) in enumerate(zip(iter_file_pairs, datasets)):
             print(f'  Processing iteration {i}: {file.name}')
-            with BisiclesFile(file) as bfile:
-                ds = bfile.read_dataset(self.variables, lev=self.lev, order=self.order)
-            iter_slices.append(ds)
+            for var, da in ds.data_vars.items():
+                if var not in stacks:
+                    # NaN-filled so iterations missing a variable stay empty
+                    stack = np.full((n_iters, *da.shape), np.nan, dtype=da.dtype)
+                    stacks[var] = (stack, da.attrs)
+                    coords = {'x': da.x.values, 'y': da.y.values}
+                stacks[var][0][n] = da.values
         
         iter_nums = [i for i, _ in iter_file_pairs]
-        batched = xr.concat(iter_slices, dim='iteration')
-        batched = batched.assign_coords(iteration=iter_nums)
+        data_vars = {var: (('iteration', 'y', 'x'), stack, attrs) for var, (stack, attrs) in stacks.items()}
+        batched = Dataset(data_vars, coords={'iteration': iter_nums, **coords})
 
         return batched
     
-    def batch_time(self, files: list[Path]):
-        """Concatenate all inverse problems along the time dimension"""
-
-        iters = defaultdict(list)
-        for file in files:
-            time, iteration = get_time_and_iteration(file)
-            iters[time].append((iteration, file))
+    def batch_time(self, files: list[tuple[float, int, Path]]):
+        """Concatenate all inverse problems along the time dimension, given sorted (time, iteration, file) tuples"""
 
+        # files are read in worker processes as described in processing.py
+        times = []
         timeslices = []
-        for time, tfiles in iters.items():
-            print(f'Processing timestep {time} with {len(tfiles)} iterations')
-            ds = self.batch_iterations(tfiles)
-            timeslices.append(ds)
+        # with a single worker, read in-process (executor=None) rather than through a pool of one
+        pool = nullcontext() if self.workers == 1 else \
+            ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+        with pool as executor:
+            for time, group in groupby(files, key=itemgetter(0)):
+                tfiles = [(iteration, file) for _, iteration, file in group]
+                print(f'Processing timestep {time} with {len(tfiles)} iterations')
+                ds = self.batch_iterations(tfiles, executor=executor)
+                times.append(time)
+                timeslices.append(ds)
 
-        batched = xr.concat(timeslices, dim='time')
-        batched = batched.assign_coords(time=list(iters.keys()))
+        # Single concat at the end; x/y are identical across files so skip comparing them. The
+        # default outer join is kept because inverse problems can have different iteration counts.
+        # NB: data_vars must stay 'all' – time is a new dimension, so 'minimal' would not stack them
+        batched = xr.concat(timeslices, dim='time', data_vars='all', coords='minimal', compat='override')
+        batched = batched.assign_coords(time=times)
         return batched
 
     def process_ctrl(self, ctrl_dir: Path, outfile: Path) -> None:
-        """Extract data from a ctrl directory into a netcdf file"""
+        """Extract data from a ctrl directory into a netcdf file, or a zarr store if outfile ends in .zarr"""
 
-        if outfile.is_file():
+        if outfile.exists():
             print(f'{outfile} already exists.')
             return
         
-        files = sorted(ctrl_dir.glob('ctrl.*.2d.hdf5'))
+        files = find_ctrl_files(ctrl_dir)
         if len(files) == 0:
             print(f"No ctrl files found in {ctrl_dir}")
             return
         
         print(f"Processing variables {', '.join(self.variables)} at level {self.lev} from {ctrl_dir}")
+        if MPI.COMM_WORLD.size > 1:
+            # ctrl files aren't sharded over ranks, so every rank would write the same outfile, and
+            # MPI can't be initialised again in the reader processes spawned from a rank
+            print("process_ctrl.py runs on a single MPI rank; use --workers to read files in parallel")
+            return
+        zarr = outfile.suffix == '.zarr'
         ds = self.batch_time(files)
         for var in ds.data_vars:
-            ds[var].encoding.update(self.encoding_specs(var))
+            ds[var].encoding.update(self.encoding_specs(var, zarr=zarr))
         
         print("Preparing data to write...")
         ds = ds.chunk({'time': 1, 'iteration': 16, 'y': 768, 'x': 768})
         print(f"Generating {outfile}...")
         try:
             with ProgressBar():
-                ds.to_netcdf(outfile)
+                if zarr:
+                    ds.to_zarr(outfile)
+                else:
+                    ds.to_netcdf(outfile)
             print(f"Successfully created {outfile}")
         except Exception as e:
             print(f"Error generating {outfile}: {e}")
-            outfile.unlink()
+            remove_output(outfile)
         except KeyboardInterrupt:
-            outfile.unlink()
+            remove_output(outfile)
         print('done')
 
+def remove_output(outfile: Path) -> None:
+    """Remove a partially written netcdf file or zarr store"""
+    if outfile.is_dir():
+        shutil.rmtree(outfile)
+    else:
+        outfile.unlink(missing_ok=True)
+
+def read_file(file: Path, variables: list, lev: int=0, order: int=0) -> Dataset:
+    """Read variables from a single BISICLES file (module level so it can run in a worker process)"""
+    with BisiclesFile(file) as bfile:
+        return bfile.read_dataset(variables, lev=lev, order=order)
+
+def find_ctrl_files(ctrl_dir: Path) -> list[tuple[float, int, Path]]:
+    """
+    List ctrl files as (time, iteration, file) tuples sorted numerically, using a single directory
+    scan. Each filename is parsed once and the parsed keys are reused for grouping by time, so the
+    order doesn't rely on the numbers in the filenames being zero-padded
+    """
+    with os.scandir(ctrl_dir) as entries:
+        files = [
+            (*get_time_and_iteration(Path(entry.name)), Path(entry.path)) for entry in entries
+            if entry.name.startswith('ctrl.') and entry.name.endswith('.2d.hdf5')
+        ]
+    files.sort()
+    return files
+
 def get_time_and_iteration(file: Path):
 
     """
@@ -135,13 +214,15 @@ def get_time_and_iteration(file: Path):
     Exact conversion of time value will depend on the BISICLES option
     dt_typical found in the inputs script.
     """
-    pattern = re.compile(r"\.(\d{6})(\d{6})\.")
-    match = pattern.search(file.name)
-    if not match:
+    # the 12-digit block is always third from the end (<block>.2d.hdf5), so plain string
+    # slicing is enough and avoids running a regex over every filename
+    parts = file.name.split('.')
+    block = parts[-3] if len(parts) >= 3 else ''
+    if len(block) != 12 or not block.isdigit():
         raise ValueError(f"No 6+6 digit block found in {file}")
     dt_typical = 1 # see BISICLES inputs
-    time = float(match.group(1)) * dt_typical
-    iteration = int(match.group(2))
+    time = float(block[:6]) * dt_typical
+    iteration = int(block[6:])
     
     return time, iteration
 
@@ -152,22 +233,28 @@ def create_parser() -> argparse.ArgumentParser:
     
     # add arguments
     parser.add_argument("ctrl_dir", type=Path, help="Path to BISICLES output directory")
-    parser.add_argument("outfile", type=Path, help="Filepath for output netcdf file")
+    parser.add_argument("outfile", type=Path, help="Filepath for output netcdf file (or .zarr store)")
     parser.add_argument("variables", type=str, nargs='+', help="One or more variable names") 
 
     # add optional arguments
     parser.add_argument("--lev", type=int, default=0, help="level of refinement")
     parser.add_argument("--order", type=int, default=0, help="interpolation order (0=piecewise constant, 1=linear)")
+    add_processing_args(parser) # --workers, --compression, --separate
 
     return parser
 
+def run(args: argparse.Namespace, variables: list[str], outfile: Path, workers: int=None) -> None:
+
+    proc = Processor(variables=variables, lev=args.lev, order=args.order, workers=workers, compression=args.compression)
+    proc.process_ctrl(args.ctrl_dir, outfile)
+
 def main():
 
     parser = create_parser()
     args = parser.parse_args()
     args.outfile.parent.mkdir(parents=True, exist_ok=True)
-    proc = Processor(variables=args.variables, lev=args.lev)
-    proc.process_ctrl(args.ctrl_dir, args.outfile)
+
+    run_variables(run, args, parser)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,21 +4,49 @@
 Script to extract data from hdf5 plotfiles and save it as a netcdf.
 
 Usage: "python process_plot.py <plot_directory> <outfile_path> <variable> [<variable> ...] [options]
+
+When launched on several MPI ranks (e.g. srun -n 4 python process_plot.py ...), the plotfiles are
+split between ranks and the per-rank results are combined into the outfile by rank 0. Each rank
+reads its files in-process (--workers is ignored), so launch up to one rank per core.
+
 Options:
  --lev   : level of refinement
  --order : interpolation order (0=piecewise constant, 1=linear)
+ --workers : number of processes for reading files (default=all cores)
+ --compression : netcdf compression codec, zlib (default) or zstd
+ --chunks : netcdf chunk sizes as time,y,x, where -1 means the full length of that dimension.
+            The default (1,192,192) at lev 0, or (1,768,768) above, suits reading whole maps;
+            for time series at a point use e.g. --chunks=-1,32,32 (the '=' is needed, as argparse
+            would otherwise take -1,32,32 for an option)
+ --format : NETCDF4 (default, compressed) or NETCDF3_64BIT, which is uncompressed but can be
+            read by many threads at once (netcdf4/hdf5 serialises reads of a file)
+ --stream : write each time slice as soon as it is read, so compressing and writing overlap with
+            reading the following files and the time series is never held in memory at once
+ --separate : write each variable to its own outfile (<outfile stem>_<variable>), processing the
+              variables in parallel
 """
 
+import os
 import argparse
+import netCDF4
 import numpy as np
 import xarray as xr
 from pathlib import Path
-from mpi4py import MPI # needed to run the MPI routines in amrio on archer2
+from xarray import Dataset
+from functools import partial, cached_property
+from itertools import islice
+from collections import deque
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
 from dask.diagnostics import ProgressBar
 
 # NB: amrfile and, by extension, BisiclesFile need the BISICLES AMRfile directory added to PYTHONPATH 
 # and the libamrfile directory added to LD_LIBRARY_PATH – see my .bashrc for an example
 from bisiclesfile import BisiclesFile
+from processing import compression_specs, add_processing_args, run_variables
+
+PRECISION = 0.001   # 3 decimal places precision
+FILL_VALUE = -9999
 
 class Processor:
     """
@@ -30,56 +58,81 @@ class Processor:
     :variables: List of variable names to extract, e.g. ['thickness', 'Z_base']
     :lev: Level of refinement to extract (default=0)
     :order: Interpolation order (0=piecewise constant, 1=linear), default=0
+    :workers: Number of processes used to read files in parallel (default=all cores)
+    :compression: netcdf compression codec, 'zlib' (default) or 'zstd'
+    :chunks: netcdf chunk sizes (time, y, x), -1 for a full dimension (default=map-style chunks)
+    :format: netcdf file format, 'NETCDF4' (default) or 'NETCDF3_64BIT' (uncompressed)
+    :stream: write each file's time slice as soon as it is read rather than batching the whole
+             time series in memory first (default=False)
     """
 
     def __init__(
         self, 
         variables: list, 
         lev: int=0,
-        order: int=0
+        order: int=0,
+        workers: int=None,
+        compression: str='zlib',
+        chunks: tuple=None,
+        format: str='NETCDF4',
+        stream: bool=False
     ):
         self.variables = variables
         self.lev = lev
         self.order = order
+        self.workers = workers
+        self.compression = compression
+        self.chunks = chunks
+        self.format = format
+        self.stream = stream
 
-    @property
+    @cached_property
     def encoding_specs(self):
         """Encoding specifications for netcdf output"""
-        xchunks = ychunks = 192 if self.lev == 0 else 768
-        tchunks = 147 if self.lev == 0 else 49  # 2 time chunks for 0lev when simulating 2007-2300
-        self.specs = {
-            'zlib': True,
-            'complevel': 4,
+        # one time step per chunk by default, so reading a map doesn't pull in the whole time series
+        yxchunks = 192 if self.lev == 0 else 768
+        tchunks, ychunks, xchunks = self.chunks or (1, yxchunks, yxchunks)
+        # no scale_factor here – fields are already quantised on read (see quantize) and carry
+        # scale_factor as an attribute, so xarray writes the integers untouched
+        # computed once and shared, so callers copy it before modifying
+        return {
+            **compression_specs(self.compression, complevel=4),
             'dtype': 'int32',
-            'scale_factor': 0.001,   # 3 decimal places precision
-            '_FillValue': -9999,
+            '_FillValue': FILL_VALUE,
             'chunksizes': (tchunks, ychunks, xchunks)  # (time, y, x)
         }
-        return self.specs
 
     def batch_time(self, files: list[Path]):
         """Concatenate all files along the time dimension"""
 
+        # Fill one preallocated (time, y, x) integer array per variable rather than building and
+        # concatenating a Dataset per file, so each variable is allocated exactly once
         times = []
-        slices = []
-        for i, file in enumerate(files, 1):
+        stacks = {}
+        coords = {}
+        results = self.read_files(files)
+        for i, (file, (time, ds)) in enumerate(zip(files, results), 1):
             print(f"({i}/{len(files)}) {file.name}")
 
-            with BisiclesFile(file) as bfile:
-                ds = bfile.read_dataset(self.variables, lev=self.lev, order=self.order)
-                time = bfile.query_time()
-
             # Sometimes, multiple plotfiles can be written with times e.g. 200.0000 and 200.0001.
             # We skip files with times that are very close to the last time.
             if times and np.isclose(times[-1], time, atol=0.05):
                 print(f"A time close to {time} already exists in dataset. Skipping file {file.name}.")
                 continue
 
+            for var, da in ds.data_vars.items():
+                if var not in stacks:
+                    # fill value marks times where a file is missing a variable
+                    stack = np.full((len(files), *da.shape), FILL_VALUE, dtype=da.dtype)
+                    stacks[var] = (stack, da.attrs)
+                    coords = {'x': da.x.values, 'y': da.y.values}
+                stacks[var][0][len(times)] = da.values
             times.append(time)
-            slices.append(ds)
-            
-        batched = xr.concat(slices, dim='time')
-        batched = batched.assign_coords(time=times)
+
+        # trim the rows left unused by skipped files
+        n = len(times)
+        data_vars = {var: (('time', 'y', 'x'), stack[:n], attrs) for var, (stack, attrs) in stacks.items()}
+        batched = Dataset(data_vars, coords={'time': times, **coords})
         return batched
 
     def process_plot(self, plot_dir: Path, outfile: Path) -> None:
@@ -89,30 +142,249 @@ class Processor:
             print(f'{outfile} already exists.')
             return
         
-        files = sorted(plot_dir.glob('plot.*.2d.hdf5'))
+        files = find_plotfiles(plot_dir)
         if len(files) == 0:
             print(f"No plot files found in {plot_dir}")
             return
         
         print(f"Processing variables: {', '.join(self.variables)} at level {self.lev} from {plot_dir}")
+        from mpi4py import MPI # only the rank count is needed here; amrio gets MPI via bisiclesfile
+        comm = MPI.COMM_WORLD
+        if comm.size > 1:
+            # each rank reads its own files in-process: MPI can't be initialised again in processes
+            # spawned from a rank, and ranks x cores workers would oversubscribe the node
+            self.workers = 1
+            self.process_plot_mpi(files, outfile, comm)
+            return
+
+        if self.stream:
+            self.stream_netcdf(files, outfile)
+            return
+
         ds = self.batch_time(files)
+        self.write_netcdf(ds, outfile)
+
+    def process_plot_mpi(self, files: list[Path], outfile: Path, comm) -> None:
+        """
+        Shard the plotfiles over MPI ranks. Each rank batches a contiguous block of files (so time
+        stays ordered) into its own part file, then rank 0 combines the parts into outfile.
+        """
+
+        blocks = np.array_split(np.arange(len(files)), comm.size)
+        parts = [outfile.with_name(f'{outfile.name}.part{rank:04d}') for rank, block in enumerate(blocks) if len(block)]
+        
+        # parts are stored quantised but uncompressed – compression happens once in the final write
+        part_encoding = {key: self.encoding_specs[key] for key in ('dtype', '_FillValue')}
+        try:
+            block = blocks[comm.rank]
+            if len(block):
+                part = parts[comm.rank]
+                part.unlink(missing_ok=True) # left over from an earlier failed run
+                ds = self.batch_time([files[i] for i in block])
+                # written under a temporary name so that an existing part is always complete
+                tmp = part.with_name(f'{part.name}.tmp')
+                ds.to_netcdf(tmp, encoding={var: part_encoding for var in ds.data_vars})
+                tmp.rename(part)
+        finally:
+            comm.Barrier() # don't leave other ranks waiting if this one fails
+
+        if comm.rank != 0:
+            return
+
+        try:
+            missing = [part.name for part in parts if not part.is_file()]
+            if missing:
+                print(f"Cannot combine part files, missing {', '.join(missing)}")
+                return
+
+            print(f"Combining {len(parts)} part files...")
+            # mask_and_scale=False keeps the quantised integers rather than decoding them to floats
+            with xr.open_mfdataset(parts, combine='nested', concat_dim='time', data_vars='all', mask_and_scale=False,
+                                   coords='minimal', compat='override', join='override') as ds:
+                # neighbouring ranks can each hold one of a pair of near-identical times
+                times = ds.time.values
+                keep = np.concatenate([[True], ~np.isclose(np.diff(times), 0, atol=0.05)])
+                self.write_netcdf(ds.isel(time=keep), outfile)
+        finally:
+            # parts are only valid for this run's files, variables and level, so never keep them
+            for part in parts:
+                part.unlink(missing_ok=True)
+
+    def stream_netcdf(self, files: list[Path], outfile: Path) -> None:
+        """
+        Write each plotfile's quantised slice to outfile as soon as a worker has read it. Compression
+        and writing in this process overlap with the workers reading the following files, and only
+        a few time slices are held in memory at once (see read_files), rather than the whole time series
+        """
+
+        specs = self.encoding_specs
+        nc_kwargs = {}
+        if not self.format.startswith('NETCDF3'):
+            # netcdf3 supports neither chunking nor compression
+            nc_kwargs = {key: val for key, val in specs.items() if key not in ('dtype', '_FillValue')}
+
+        print(f"Generating {outfile}...")
+        try:
+            with netCDF4.Dataset(outfile, 'w', format=self.format) as nc:
+                results = self.read_files(files)
+                ncvars = {}
+                last_time = None
+                for i, (file, (time, ds)) in enumerate(zip(files, results), 1):
+                    print(f"({i}/{len(files)}) {file.name}")
+
+                    # skip near-duplicate times, as in batch_time
+                    if last_time is not None and np.isclose(last_time, time, atol=0.05):
+                        print(f"A time close to {time} already exists in dataset. Skipping file {file.name}.")
+                        continue
+
+                    if last_time is None:
+                        # define dimensions and coordinates from the first slice
+                        nc.createDimension('time', None)
+                        nc.createDimension('y', ds.sizes['y'])
+                        nc.createDimension('x', ds.sizes['x'])
+                        nc.createVariable('time', 'f8', ('time',))
+                        nc.createVariable('y', 'f8', ('y',))[:] = ds.y.values
+                        nc.createVariable('x', 'f8', ('x',))[:] = ds.x.values
+                        if 'chunksizes' in nc_kwargs:
+                            # resolve -1 (time is unlimited, so bound it by the number of files)
+                            sizes = (len(files), ds.sizes['y'], ds.sizes['x'])
+                            nc_kwargs['chunksizes'] = tuple(size if chunk == -1 else min(chunk, size) 
+                                                            for chunk, size in zip(specs['chunksizes'], sizes))
+
+                    n = len(nc['time'])
+                    for var, da in ds.data_vars.items():
+                        if var not in ncvars:
+                            # earlier slices of a variable missing from previous files read as fill value
+                            ncvars[var] = nc.createVariable(var, specs['dtype'], ('time', 'y', 'x'), 
+                                                            fill_value=specs['_FillValue'], **nc_kwargs)
+                            ncvars[var].set_auto_maskandscale(False) # values are already quantised
+                            ncvars[var].setncatts(da.attrs)
+                        ncvars[var][n] = da.values
+                    nc['time'][n] = time
+                    last_time = time
+            print(f"Successfully created {outfile}")
+        except Exception as e:
+            print(f"Error generating {outfile}: {e}")
+            outfile.unlink(missing_ok=True)
+        except KeyboardInterrupt:
+            outfile.unlink(missing_ok=True)
+        print('done')
+
+    def read_files(self, files: list[Path]):
+        """
+        Yield (time, quantised Dataset) for each file in order, read by a pool of workers. Only
+        about two files per worker are in flight at once, so results can't pile up in memory
+        faster than the caller consumes them. With a single worker, files are read in-process
+        """
+
+        read = partial(read_file, variables=self.variables, lev=self.lev, order=self.order)
+        if self.workers == 1:
+            yield from map(read, files)
+            return
+
+        # files are read in worker processes as described in processing.py
+        max_pending = 2 * (self.workers or os.cpu_count())
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn')) as executor:
+            queue = iter(files)
+            pending = deque(executor.submit(read, file) for file in islice(queue, max_pending))
+            try:
+                while pending:
+                    result = pending.popleft().result()
+                    for file in islice(queue, 1):
+                        pending.append(executor.submit(read, file))
+                    yield result
+            finally:
+                for future in pending:
+                    future.cancel() # don't finish reading files nobody will consume
+
+    def write_netcdf(self, ds: Dataset, outfile: Path) -> bool:
+        """Encode, chunk, and write a batched dataset to netcdf. Returns whether the write succeeded"""
+
+        # resolve -1 to the full dimension and keep chunks within the dimension sizes
+        specs = dict(self.encoding_specs)
+        sizes = (ds.sizes['time'], ds.sizes['y'], ds.sizes['x'])
+        tc, yc, xc = (size if chunk == -1 else min(chunk, size) for chunk, size in zip(specs['chunksizes'], sizes))
+        specs['chunksizes'] = (tc, yc, xc)
+        if self.format.startswith('NETCDF3'):
+            # netcdf3 supports neither chunking nor compression
+            specs = {key: specs[key] for key in ('dtype', '_FillValue')}
+
+        # drop encoding carried over from the source (e.g. contiguous=True from uncompressed part
+        # files), which netcdf4 would reject alongside chunksizes and compression
+        ds = ds.drop_encoding()
         for var in ds.data_vars:
-            ds[var].encoding.update(self.encoding_specs)
+            ds[var].attrs.pop('_FillValue', None) # set via encoding instead (present if read from parts)
+            ds[var].encoding.update(specs)
 
         print("Chunking dataset for dask...")
-        tc, yx, xc = self.encoding_specs['chunksizes']
-        ds = ds.chunk({'time': tc, 'y': yx, 'x': xc})
+        ds = ds.chunk({'time': tc, 'y': yc, 'x': xc})
         print(f"Generating {outfile}...")
         try:
             with ProgressBar():
-                ds.to_netcdf(outfile)
+                ds.to_netcdf(outfile, format=self.format)
             print(f"Successfully created {outfile}")
+            return True
         except Exception as e:
             print(f"Error generating {outfile}: {e}")
-            outfile.unlink()
+            outfile.unlink(missing_ok=True)
+            return False
         except KeyboardInterrupt:
-            outfile.unlink()
-        print('done')
+            outfile.unlink(missing_ok=True)
+            return False
+        finally:
+            print('done')
+
+def plot_step(filename: str) -> int:
+    """
+    Extract the step number from a plotfile name like 'plot.AIS.run001.000120.2d.hdf5' -> 120.
+    The step block is always third from the end, so no regex is needed.
+    """
+    block = filename.split('.')[-3]
+    if not block.isdigit():
+        raise ValueError(f"No step number found in {filename}")
+    return int(block)
+
+def find_plotfiles(plot_dir: Path) -> list[Path]:
+    """List plotfiles in plot_dir in numerical step order, using a single directory scan"""
+    steps = []
+    with os.scandir(plot_dir) as entries:
+        for entry in entries:
+            if not (entry.name.startswith('plot.') and entry.name.endswith('.2d.hdf5')):
+                continue
+            try:
+                steps.append((plot_step(entry.name), entry.path))
+            except ValueError:
+                print(f"Skipping {entry.name}: no step number found in its name")
+    steps.sort()
+    return [Path(path) for _, path in steps]
+
+def quantize(ds: Dataset, precision: float=PRECISION, fill_value: int=FILL_VALUE, dtype: str='int32') -> Dataset:
+    """
+    Store each field as integers in units of precision, with NaNs set to fill_value. The
+    scale_factor attribute lets netcdf readers unscale them, and the integer arrays take half the
+    memory of float64 while batching and writing.
+    """
+    for var in list(ds.data_vars):
+        field = ds[var].values
+        quantized = field / precision
+        np.rint(quantized, out=quantized)
+        quantized[np.isnan(field)] = fill_value
+        ds[var] = (ds[var].dims, quantized.astype(dtype), {**ds[var].attrs, 'scale_factor': precision})
+    return ds
+
+def read_file(file: Path, variables: list, lev: int=0, order: int=0) -> tuple[float, Dataset]:
+    """Read the time and quantised variables from a single plotfile (module level so it can run in a worker process)"""
+    with BisiclesFile(file) as bfile:
+        ds = bfile.read_dataset(variables, lev=lev, order=order)
+        time = bfile.query_time()
+    return time, quantize(ds)
+
+def parse_chunks(text: str) -> tuple[int, int, int]:
+    """Parse chunk sizes given as 'time,y,x'"""
+    chunks = tuple(int(chunk) for chunk in text.split(','))
+    if len(chunks) != 3:
+        raise argparse.ArgumentTypeError(f"Expected chunks as time,y,x but got {text}")
+    return chunks
 
 def create_parser() -> argparse.ArgumentParser:
 
@@ -127,16 +399,28 @@ def create_parser() -> argparse.ArgumentParser:
     # add optional arguments
     parser.add_argument("--lev", type=int, default=0, help="level of refinement")
     parser.add_argument("--order", type=int, default=0, help="interpolation order (0=piecewise constant, 1=linear)")
+    add_processing_args(parser) # --workers, --compression, --separate
+    parser.add_argument("--chunks", type=parse_chunks, default=None,
+                        help="netcdf chunk sizes as time,y,x (-1 = full dimension), e.g. --chunks=-1,32,32 for time series reads")
+    parser.add_argument("--format", type=str, default='NETCDF4', choices=['NETCDF4', 'NETCDF3_64BIT'],
+                        help="netcdf format (NETCDF3_64BIT is uncompressed but allows concurrent multi-threaded reads)")
+    parser.add_argument("--stream", action='store_true',
+                        help="write each time slice as soon as it is read, overlapping reads with compression and writing")
 
     return parser
 
+def run(args: argparse.Namespace, variables: list[str], outfile: Path, workers: int=None) -> None:
+
+    proc = Processor(variables=variables, lev=args.lev, order=args.order, workers=workers, compression=args.compression, chunks=args.chunks, format=args.format, stream=args.stream)
+    proc.process_plot(args.plot_dir, outfile)
+
 def main():
 
     parser = create_parser()
     args = parser.parse_args()
     args.outfile.parent.mkdir(parents=True, exist_ok=True)
-    proc = Processor(variables=args.variables, lev=args.lev)
-    proc.process_plot(args.plot_dir, args.outfile)
+
+    run_variables(run, args, parser)
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
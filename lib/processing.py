@@ -0,0 +1,78 @@
+"""
+Command line and output options shared by process_plot.py and process_ctrl.py: the netcdf
+compression codec, the common parallelism arguments, and the --separate fan-out that processes
+each variable in its own process.
+
+Both processors read files in a pool of worker processes (--workers). An amrio handle can't be
+shared between processes, so each worker opens and reads whole files and returns the loaded
+Dataset. Workers are spawned rather than forked, so each starts a fresh interpreter that
+initialises MPI itself; that works from a plain python process, but not from one launched as an
+MPI rank (e.g. by srun on Cray MPICH). So on several ranks process_plot reads each rank's files
+in-process and process_ctrl refuses to run; both also read in-process when --workers is 1.
+"""
+
+import os
+import argparse
+from pathlib import Path
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+def compression_specs(compression: str='zlib', complevel: int=4) -> dict:
+    """
+    netcdf encoding entries for the given compression codec. zstd compresses faster than
+    zlib (DEFLATE) at a similar or better ratio, but requires netCDF4 >= 1.6 and the HDF5 blosc
+    filter plugin, whose directory must be on HDF5_PLUGIN_PATH (also needed to read the file).
+
+    Both codecs byte-shuffle: scaled-integer fields only use the low bytes of each value, so
+    grouping bytes together gives long runs that compress much better. netCDF4 only applies the
+    HDF5 shuffle filter alongside zlib, so zstd goes through blosc, which shuffles internally
+    """
+    if compression == 'zlib':
+        return {'zlib': True, 'complevel': complevel, 'shuffle': True}
+    if compression == 'zstd':
+        return {'compression': 'blosc_zstd', 'blosc_shuffle': 1, 'complevel': complevel}
+    raise ValueError(f"Unsupported compression: {compression}. Expected 'zlib' or 'zstd'")
+
+def add_processing_args(parser: argparse.ArgumentParser) -> None:
+    """Add the parallelism and output options shared by process_plot and process_ctrl"""
+    parser.add_argument("--workers", type=int, default=None, help="number of processes for reading files (default=all cores)")
+    parser.add_argument("--compression", type=str, default='zlib', choices=['zlib', 'zstd'],
+                        help="netcdf compression codec (zstd is faster but needs HDF5_PLUGIN_PATH set)")
+    parser.add_argument("--separate", action='store_true',
+                        help="write each variable to its own outfile (<outfile stem>_<variable>), processing them in parallel")
+
+def variable_outfile(outfile: Path, variable: str) -> Path:
+    """
+    Outfile for a single variable when variables are written to separate files, e.g.
+    out.nc -> out_thickness.nc
+    """
+    return outfile.with_name(f"{outfile.stem}_{variable}{outfile.suffix}")
+
+def run_variables(run, args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    """
+    Call run(args, variables, outfile, workers) for all of args.variables at once, or with
+    --separate, once per variable in parallel, each writing its own outfile. run must be a module
+    level function so it can be sent to a spawned process
+    """
+
+    if not args.separate or len(args.variables) == 1:
+        run(args, args.variables, args.outfile, args.workers)
+        return
+
+    from mpi4py import MPI # only needed to refuse --separate under several ranks
+    if MPI.COMM_WORLD.size > 1:
+        parser.error("--separate cannot be combined with multiple MPI ranks")
+
+    # Output files are independent, so give each variable its own process and share the cores
+    # between their file-reading pools. ProcessPoolExecutor workers (unlike Pool's) are not
+    # daemonic, so they can start pools of their own
+    nvars = len(args.variables)
+    cores = args.workers or os.cpu_count()
+    workers = max(1, cores // nvars)
+    with ProcessPoolExecutor(max_workers=min(nvars, cores), mp_context=get_context('spawn')) as executor:
+        jobs = [
+            executor.submit(run, args, [var], variable_outfile(args.outfile, var), workers)
+            for var in args.variables
+            ]
+        for job in jobs:
+            job.result() # re-raise any failure
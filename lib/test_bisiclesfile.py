@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('amrfile') # bisiclesfile needs the BISICLES AMRfile python bindings
+
+from bisiclesfile import BisiclesFile
+
+BOX = np.dtype([('lo_i', '<i4'), ('lo_j', '<i4'), ('hi_i', '<i4'), ('hi_j', '<i4')])
+INTVECT = np.dtype([('intvecti', '<i4'), ('intvectj', '<i4')])
+
+def write_plotfile(path, fields, boxes, dx=1000.0, ghost=1, time=12.34):
+    """
+    Write a minimal Chombo level 0 plotfile holding fields (name -> (ny, nx) array) split into
+    boxes given as (lo_i, lo_j, hi_i, hi_j), each stored with ghost cells as (component, y, x)
+    """
+    names = list(fields)
+    ny, nx = next(iter(fields.values())).shape
+    padded = {name: np.pad(field, ghost, constant_values=-1.0) for name, field in fields.items()}
+
+    blocks = []
+    for i0, j0, i1, j1 in boxes:
+        block = np.stack([padded[name][j0:j1 + 1 + 2 * ghost, i0:i1 + 1 + 2 * ghost] for name in names])
+        blocks.append(block.ravel())
+    offsets = np.concatenate([[0], np.cumsum([len(block) for block in blocks])])
+
+    with h5py.File(path, 'w') as f:
+        f.attrs['time'] = time
+        f.attrs['num_components'] = len(names)
+        for c, name in enumerate(names):
+            f.attrs[f'component_{c}'] = np.bytes_(name)
+        level = f.create_group('level_0')
+        level.attrs['dx'] = dx
+        level.attrs['prob_domain'] = np.array((0, 0, nx - 1, ny - 1), dtype=BOX)
+        level.create_group('data_attributes').attrs['outputGhost'] = np.array((ghost, ghost), dtype=INTVECT)
+        level.create_dataset('boxes', data=np.array(boxes, dtype=BOX))
+        level.create_dataset('data:offsets=0', data=offsets)
+        level.create_dataset('data:datatype=0', data=np.concatenate(blocks))
+
+def test_read_lev0_h5(tmp_path, capsys):
+    """Level 0 boxes are pasted into one array without their ghost cells, with cell-centre coords"""
+
+    ny, nx = 3, 5
+    thickness = np.arange(ny * nx, dtype=float).reshape(ny, nx)
+    xvel = -thickness
+    file = tmp_path / 'plot.test.000010.2d.hdf5'
+    write_plotfile(file, {'thickness': thickness, 'xVel': xvel}, boxes=[(0, 0, 1, 2), (2, 0, 4, 2)])
+
+    with BisiclesFile(file) as bfile:
+        ds = bfile.read_dataset(['thickness', 'xVel', 'Z_base'], lev=0)
+        time = bfile.query_time()
+
+    assert 'Z_base' not in ds
+    assert "does not contain variable 'Z_base'" in capsys.readouterr().out
+    np.testing.assert_array_equal(ds['thickness'].values, thickness)
+    np.testing.assert_array_equal(ds['xVel'].values, xvel)
+    np.testing.assert_allclose(ds.x.values, [500, 1500, 2500, 3500, 4500])
+    np.testing.assert_allclose(ds.y.values, [500, 1500, 2500])
+    assert ds['thickness'].attrs['units'] == 'm'
+    assert time == 12.3
+
+def test_query_time_without_read(tmp_path):
+    """query_time reads the time attribute itself when no level 0 read has opened the file"""
+
+    file = tmp_path / 'plot.test.000020.2d.hdf5'
+    write_plotfile(file, {'thickness': np.zeros((2, 2))}, boxes=[(0, 0, 1, 1)], time=200.04)
+
+    with BisiclesFile(file) as bfile:
+        assert bfile.query_time() == 200.0
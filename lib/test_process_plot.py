@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import xarray as xr
+from pathlib import Path
+from xarray import Dataset
+
+pytest.importorskip('netCDF4')
+pytest.importorskip('amrfile') # bisiclesfile needs the BISICLES AMRfile python bindings
+
+import process_plot
+from process_plot import Processor, quantize, PRECISION, FILL_VALUE
+
+def make_dataset(field: np.ndarray) -> Dataset:
+    ny, nx = field.shape
+    return Dataset(
+        {'thickness': (('y', 'x'), field, {'units': 'm'})},
+        coords={'x': np.arange(nx) * 1e3, 'y': np.arange(ny) * 1e3}
+    )
+
+@pytest.fixture
+def plotfiles(monkeypatch):
+    """
+    Three fake plotfiles, the second with a time within 0.05 of the first, read in-process by a
+    stand-in for read_file that quantises the fields as the real one does
+    """
+    rng = np.random.default_rng(0)
+    slices = {}
+    for step, time in [(0, 0.0), (1, 0.01), (2, 10.0)]:
+        field = rng.uniform(-500, 3000, size=(4, 6))
+        field[0, step] = np.nan
+        slices[f'plot.test.{step:06d}.2d.hdf5'] = (time, field)
+
+    def read_file(file, variables, lev=0, order=0):
+        time, field = slices[file.name]
+        return time, quantize(make_dataset(field.copy()))
+
+    monkeypatch.setattr(process_plot, 'read_file', read_file)
+    return [Path(name) for name in slices], slices
+
+def test_quantize():
+    """Fields become int32 multiples of precision, rounded to nearest, with NaN as the fill value"""
+
+    ds = quantize(make_dataset(np.array([[1.0004, 1.0006], [-2.3456, np.nan]])))
+    da = ds['thickness']
+    assert da.dtype == np.int32
+    np.testing.assert_array_equal(da.values, [[1000, 1001], [-2346, FILL_VALUE]])
+    assert da.attrs == {'units': 'm', 'scale_factor': PRECISION}
+
+def test_batch_time_skips_near_duplicate_time(plotfiles):
+    files, slices = plotfiles
+    ds = Processor(['thickness'], workers=1).batch_time(files)
+    np.testing.assert_array_equal(ds.time.values, [0.0, 10.0])
+    assert ds['thickness'].shape == (2, 4, 6)
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_netcdf_round_trip(tmp_path, plotfiles, stream):
+    """Written values decode to within PRECISION, NaNs come back and the near-duplicate is dropped"""
+
+    files, slices = plotfiles
+    proc = Processor(['thickness'], workers=1)
+    outfile = tmp_path / 'out.nc'
+    if stream:
+        proc.stream_netcdf(files, outfile)
+    else:
+        assert proc.write_netcdf(proc.batch_time(files), outfile)
+
+    expected = np.stack([slices[files[0].name][1], slices[files[2].name][1]])
+    with xr.open_dataset(outfile) as ds:
+        np.testing.assert_array_equal(ds.time.values, [0.0, 10.0])
+        decoded = ds['thickness'].values
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(expected))
+    np.testing.assert_allclose(decoded, expected, atol=PRECISION, equal_nan=True)
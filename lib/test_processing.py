@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from xarray import Dataset
+
+from processing import compression_specs
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+@pytest.mark.parametrize('compression', ['zlib', 'zstd'])
+def test_compression_specs_shuffle(tmp_path, compression):
+    """Both codecs should write byte-shuffled variables (HDF5 shuffle for zlib, blosc's for zstd)"""
+
+    if compression == 'zstd':
+        with netCDF4.Dataset(tmp_path / 'probe.nc', 'w') as nc:
+            if not nc.has_blosc_filter():
+                pytest.skip('netCDF4/HDF5 built without the blosc filter plugin')
+
+    ds = Dataset({'thickness': (('y', 'x'), np.arange(64 * 64, dtype='int32').reshape(64, 64))})
+    outfile = tmp_path / f'{compression}.nc'
+    ds.to_netcdf(outfile, encoding={'thickness': compression_specs(compression)}, engine='netcdf4')
+
+    with netCDF4.Dataset(outfile) as nc:
+        filters = nc['thickness'].filters()
+    if compression == 'zlib':
+        assert filters['zlib']
+        assert filters['shuffle']
+    else:
+        assert filters['blosc'] == {'compressor': 'blosc_zstd', 'shuffle': 1}
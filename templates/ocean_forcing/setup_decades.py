@@ -1,14 +1,16 @@
 #!/usr/bin/env python
 import os
+import re
 
 
-def replace(inFileName, outFileName, replacements):
-    with open(inFileName, 'rt') as fin:
-        with open(outFileName, 'wt') as fout:
-            for line in fin:
-                for orig in replacements:
-                    line = line.replace(orig, replacements[orig])
-                fout.write(line)
+# placeholders filled in for each decade, substituted in one pass over the template
+KEYS = ('@outFolder', '@folders', '@years', '@tIndexMin', '@tIndexMax', '@climDecades',
+        '@climFolders', '@climFirstTIndex', '@climLastTIndex')
+PATTERN = re.compile('|'.join(map(re.escape, KEYS)))
+
+def replace(text, outFileName, replacements):
+    with open(outFileName, 'wt') as fout:
+        fout.write(PATTERN.sub(lambda match: replacements[match.group(0)], text))
 
 
 climFirstYear = 1995
@@ -19,6 +21,11 @@ climFolders = ', '.join(['{:04d}'.format(year) for year in
 
 firstYears = list(range(1995, 2299, 20))
 
+# the template is the same for every decade, so only read it once
+templateFileName = 'config.combine_@model'
+with open(templateFileName, 'rt') as fin:
+    template = fin.read()
+
 for firstYear in firstYears:
     lastYear = min(firstYear+19, 2300)
 
@@ -26,10 +33,7 @@ for firstYear in firstYears:
     folders = ', '.join(['{:04d}'.format(year) for year in
                          range(firstYear, lastYear+1)])
     print(outFolder)
-    try:
-        os.makedirs(outFolder)
-    except OSError:
-        pass
+    os.makedirs(outFolder, exist_ok=True)
 
     replacements = {'@outFolder': outFolder,
                     '@folders': folders,
@@ -40,6 +44,5 @@ for firstYear in firstYears:
                     '@climFolders': climFolders,
                     '@climFirstTIndex': '0',
                     '@climLastTIndex': '{}'.format(climLastYear-climFirstYear)}
-    templateFileName = 'config.combine_@model'
     outFileName = '{}/config.combine_@model'.format(outFolder)
-    replace(templateFileName, outFileName, replacements)
+    replace(template, outFileName, replacements)
@@ -1,25 +1,27 @@
 #!/usr/bin/env python
 import os
+import re
 
-def replace(inFileName, outFileName, replacements):
-    with open(inFileName, 'rt') as fin:
-        with open(outFileName, 'wt') as fout:
-            for line in fin:
-                for orig in replacements:
-                    line = line.replace(orig, replacements[orig])
-                fout.write(line)
+# placeholders filled in for each year, substituted in one pass over the template
+KEYS = ('@tIndex', '@year')
+PATTERN = re.compile('|'.join(map(re.escape, KEYS)))
 
+def replace(text, outFileName, replacements):
+    with open(outFileName, 'wt') as fout:
+        fout.write(PATTERN.sub(lambda match: replacements[match.group(0)], text))
+
+
+# the template is the same for every year, so only read it once
+templateFileName = 'config.@model'
+with open(templateFileName, 'rt') as fin:
+    template = fin.read()
 
 for tIndex, year in enumerate(range(1995, 2301)):
     yearString = '{:04d}'.format(year)
     print(yearString)
-    try:
-        os.makedirs(yearString)
-    except OSError:
-        pass
+    os.makedirs(yearString, exist_ok=True)
 
     replacements = {'@tIndex': '{}'.format(tIndex),
                     '@year': yearString}
-    templateFileName = 'config.@model'
     outFileName = '{}/config.@model'.format(yearString)
-    replace(templateFileName, outFileName, replacements)
+    replace(template, outFileName, replacements)
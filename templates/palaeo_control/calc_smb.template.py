@@ -1,7 +1,9 @@
 # script for calculating smb using pypdd, including corrections for ice sheet elevation
 
+import os
 import sys
-import glob
+import json
+import dask
 import numpy as np
 import xarray as xr
 from pypdd import PDDModel
@@ -12,6 +14,17 @@ genpath = '/nobackup/earjo/python_modules'
 sys.path.append(genpath)
 from amrfile import io as amrio
 
+def block_mean(a, f, pad=np.mean):
+    """
+    Mean over f x f blocks of the last two axes. When they divide evenly (the usual case) this
+    is a reshape and a single reduction, with no padded copy; otherwise fall back to block_reduce,
+    padding with pad(a)
+    """
+    *lead, ny, nx = a.shape
+    if ny % f or nx % f:
+        return block_reduce(a, block_size=(*[1]*len(lead), f, f), func=np.mean, cval=pad(a))
+    return a.reshape(*lead, ny // f, f, nx // f, f).mean(axis=(-3, -1))
+
 # read in forcing data
 NCs = [
     '@TEMP',
@@ -20,54 +33,92 @@ NCs = [
 ]
 vars = ['T2m', 'precip', 'height']
 
-data = {}
-for var, nc in zip(vars, NCs):
-    ds = xr.open_dataset(nc)
-    array = np.asarray(ds[var])
-    nonan = np.nan_to_num(array)
-    data[var] = nonan
+# The same forcing is read at every step of a run, so the first step caches the processed arrays
+# as .npy files and later steps memory-map them, letting the OS page cache serve them instead of
+# decoding and converting the netcdfs again. A manifest records which forcing files (path, size
+# and mtime) the cache was built from, and the cache is rebuilt if they don't match
+cache_dir = 'forcing_cache'
+cached = {name: os.path.join(cache_dir, f'{name}.npy') for name in vars + ['x']}
+manifest_file = os.path.join(cache_dir, 'manifest.json')
+
+def forcing_manifest():
+    manifest = []
+    for nc in NCs:
+        stat = os.stat(nc)
+        manifest.append({'path': os.path.abspath(nc), 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return manifest
+
+def cache_is_fresh():
+    if not all(os.path.exists(path) for path in list(cached.values()) + [manifest_file]):
+        return False
+    with open(manifest_file) as f:
+        return json.load(f) == forcing_manifest()
+
+if cache_is_fresh():
+    # read-only maps; block_mean below makes fresh arrays, so nothing writes to these
+    temp, precip, height, climate_x = (np.load(cached[name], mmap_mode='r') for name in vars + ['x'])
+else:
+    # open all forcing files as one lazy, dask-backed dataset (they share a grid, so take the
+    # coords from the first rather than aligning them)
+    forcing = xr.open_mfdataset(NCs, combine='by_coords', join='override', chunks='auto', parallel=True)
 
-temp = data['T2m'] - 273.15 # Kelvin to Celsius
-precip = data['precip'] / 1000 * 12 # kgm^-2yr^-1 to myr^-1
-height = data['height']
+    # compute the lazy arrays together in single precision (halving memory traffic), so the files
+    # are read in parallel by dask, then fill NaNs and convert units in place rather than
+    # allocating a new array for each step
+    temp, precip, height = dask.compute(*(forcing[var].astype(np.float32).data for var in vars))
+    for array in (temp, precip, height):
+        np.nan_to_num(array, copy=False)
+    temp -= 273.15 # Kelvin to Celsius
+    precip *= 12 / 1000 # kgm^-2yr^-1 to myr^-1
+    climate_x = forcing.x.values
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    for name, array in zip(vars + ['x'], (temp, precip, height, climate_x)):
+        np.save(cached[name], array)
+    # written last, so an interrupted save leaves no manifest and the cache is rebuilt
+    with open(manifest_file, 'w') as f:
+        json.dump(forcing_manifest(), f)
 
 # read in plotfile
-plotfiles = sorted(glob.glob('plotfiles/plot*.hdf5'))
-latest_plotfile = plotfiles[-1]
+# a single pass over the directory, rather than globbing and sorting every plotfile of the run
+# (step numbers are zero-padded, so the latest has the greatest name)
+with os.scandir('plotfiles') as entries:
+    latest = max((e for e in entries if e.name.startswith('plot') and e.name.endswith('.hdf5')), key=lambda e: e.name)
+latest_plotfile = latest.path
 amrID = amrio.load(latest_plotfile)
 level = 0
 lo, hi = amrio.queryDomainCorners(amrID, level)
 order = 0
 
-# now get relevant variables thickness and surface
+# now get the surface elevation (the only plotfile field the corrections need)
 x0, y0, zsurface0 = amrio.readBox2D(amrID, level, lo, hi, 'Z_surface', order)
-x0, y0, thk0 = amrio.readBox2D(amrID, level, lo, hi, 'thickness', order)
+zsurface0 = zsurface0.astype(np.float32)
 
-# downsample temperature and precipitation to resolution of plotfile
+# downsample temperature and precipitation to resolution of plotfile (climate_x comes from the
+# forcing read above, so there is no need to reopen it)
 plotfile_res = x0[1] - x0[0]
-climate = xr.open_dataset('@TEMP') # reads in first NC (in this case, temp)
-climate_res = climate.x[1].data - climate.x[0].data
+climate_res = climate_x[1] - climate_x[0]
 
-if plotfile_res != climate_res:
-    dsi = int(plotfile_res / climate_res)
-    base_temp = block_reduce(temp, block_size=(1, dsi, dsi), func=np.mean, cval=np.max(temp))
-    base_precip = block_reduce(precip, block_size=(1, dsi, dsi), func=np.mean, cval=np.min(precip))
-    base_height = block_reduce(height, block_size=(dsi, dsi), func=np.mean, cval=np.min(height))
+dsi = int(round(plotfile_res / climate_res)) # 1 if the resolutions already match
+base_temp = block_mean(temp, dsi, pad=np.max)
+base_precip = block_mean(precip, dsi, pad=np.min)
+base_height = block_mean(height, dsi, pad=np.min)
 
-# calculate corrections based on lapse rate
-    
-LRT = - 0.007 # temperature lapse rate (Dolan 2018)
-temp_correction = LRT * (zsurface0 - base_height)
+# calculate corrections based on lapse rate, from the elevation difference between the ice
+# surface and the climate model's surface (computed once and shared by both corrections)
+dz = zsurface0 - base_height
 
-b = len(x0)
-a = len(y0) # weird that these have to be this way around, but it works
-temp_correction_array = np.empty((12, a, b))
-for i in range(12):
-    temp_correction_array[i, :, :] = temp_correction
-temp_corrected = base_temp + temp_correction_array
+LRT = - 0.007 # temperature lapse rate (Dolan 2018)
+temp_correction = LRT * dz
+# the (y, x) correction broadcasts over the 12 months; add it in place (base_temp isn't reused)
+temp_corrected = np.add(base_temp, temp_correction, out=base_temp)
 
 LRP = @LRP # precipitation lapse rate
-precip_corrected = base_precip * np.exp (-LRP * (zsurface0 - base_height))
+precip_factor = dz * -LRP
+np.exp(precip_factor, out=precip_factor) # in place; numpy's float32 exp is SIMD-vectorised
+precip_corrected = np.multiply(base_precip, precip_factor, out=base_precip)
 
 # run PDD model
 pdds = 0.004 # pdd factor snow
@@ -82,4 +133,7 @@ X = y0 # again, weird way around but it works
 ds = xr.Dataset({'smb': (('x', 'y'), smb)},
                 coords={'x': X,
                         'y': Y})
-ds.to_netcdf('smb.nc', 'w')
\ No newline at end of file
+# compressed and chunked, so smb.nc is smaller and faster to read back
+chunks = tuple(min(256, size) for size in ds['smb'].shape)
+encoding = {'smb': {'dtype': 'float32', 'zlib': True, 'complevel': 4, 'shuffle': True, 'chunksizes': chunks}}
+ds.to_netcdf('smb.nc', 'w', encoding=encoding)
\ No newline at end of file
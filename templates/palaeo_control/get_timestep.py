@@ -1,14 +1,32 @@
 import sys
+import h5py
 
 # import amrio
 genpath = '/nobackup/earjo/python_modules'
 sys.path.append(genpath)
 from amrfile import io as amrio
 
+def read_time(plotfile):
+
+    # Chombo plotfiles store the time as an attribute of the root group (BISICLES) or of each
+    # level, so it can be read without amrio loading the whole AMR hierarchy
+    with h5py.File(plotfile, 'r') as f:
+        for group in (f, f.get('level_0')):
+            if group is not None and 'time' in group.attrs:
+                return float(group.attrs['time'])
+    return None
+
 def get_timestep(plotfile):
 
-    amrID  = amrio.load(plotfile)
-    time = amrio.queryTime(amrID)
+    time = read_time(plotfile)
+
+    # fall back to amrio if the time attribute isn't where we expect it
+    if time is None:
+        amrID = amrio.load(plotfile)
+        try:
+            time = amrio.queryTime(amrID)
+        finally:
+            amrio.free(amrID)
     time = int(time/30)*30
 
     return time
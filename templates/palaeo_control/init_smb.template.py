@@ -1,5 +1,6 @@
 # script for calculating the initial smb using RACMO and pyPDD
 
+import dask
 import numpy as np
 import xarray as xr
 from pypdd import PDDModel
@@ -11,15 +12,18 @@ NCs = [
 ]
 vars = ['T2m', 'precip']
 
-data = {}
-for var, nc in zip(vars, NCs):
-    ds = xr.open_dataset(nc)
-    array = np.asarray(ds[var])
-    nonan = np.nan_to_num(array)
-    data[var] = nonan
+# open all forcing files as one lazy, dask-backed dataset (they share a grid, so take the coords
+# from the first rather than aligning them)
+forcing = xr.open_mfdataset(NCs, combine='by_coords', join='override', chunks='auto', parallel=True)
 
-temp = data['T2m'] - 273.15         # Kelvin to Celsius
-precip = data['precip'] / 1000 * 12 # kgm^-2yr^-1 to myr^-1
+# compute the lazy arrays together in single precision (halving memory traffic), so the files
+# are read in parallel by dask, then fill NaNs and convert units in place rather than
+# allocating a new array for each step
+temp, precip = dask.compute(*(forcing[var].astype(np.float32).data for var in vars))
+for array in (temp, precip):
+    np.nan_to_num(array, copy=False)
+temp -= 273.15      # Kelvin to Celsius
+precip *= 12 / 1000 # kgm^-2yr^-1 to myr^-1
 
 # run PDD model
 pdds = 0.004 # pdd factor snow
@@ -31,4 +35,7 @@ smb = pdd_results['smb']
 ds = xr.Dataset({'smb': (('x', 'y'), smb)},
                 coords={'x': np.arange(4.0e+3,6144.0e+3,8.0e+3) - 6144.0e+3*0.5,
                         'y': np.arange(4.0e+3,6144.0e+3,8.0e+3) - 6144.0e+3*0.5})
-ds.to_netcdf('smb.nc', 'w')
\ No newline at end of file
+# compressed and chunked, so smb.nc is smaller and faster to read back
+chunks = tuple(min(256, size) for size in ds['smb'].shape)
+encoding = {'smb': {'dtype': 'float32', 'zlib': True, 'complevel': 4, 'shuffle': True, 'chunksizes': chunks}}
+ds.to_netcdf('smb.nc', 'w', encoding=encoding)
\ No newline at end of file